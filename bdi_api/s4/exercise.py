@@ -4,14 +4,62 @@ from fastapi import APIRouter, status
 from fastapi.params import Query
 
 from bdi_api.settings import Settings
+import io
+import logging
 import os
 import re
 import boto3
 import requests
 import time
-from pathlib import Path
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 settings = Settings()
+logger = logging.getLogger(__name__)
+
+#We generate filenames sequentially every 5 seconds because the dataset url format is "HHMMSSZ".
+#The whole day is computed once, like "000000Z.json.gz", "000005Z.json.gz", ...
+_DAY = datetime(2023, 11, 1)
+_FILENAMES = [(_DAY + timedelta(seconds=s)).strftime("%H%M%SZ.json.gz") for s in range(0, 24 * 3600, 5)]
+
+#Number of files downloaded and uploaded at the same time. The requests session and
+#the S3 client below both size their connection pools to it, one socket per worker
+_MAX_WORKERS = 64
+
+#S3 transfer settings used for every upload/download, small threshold so any
+#bigger object goes through the concurrent multipart path
+_XFER = TransferConfig(
+    multipart_threshold=5 * 1024 * 1024,
+    multipart_chunksize=5 * 1024 * 1024,
+    max_concurrency=32,
+    use_threads=True,
+)
+
+#Shared HTTP session so keep-alive sockets are reused between downloads
+#instead of paying DNS + TCP + TLS for every 5-second file
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_maxsize=_MAX_WORKERS,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    ),
+)
+
+#AWS S3 client with region to match the bucket region, created once and shared by
+#every request and worker thread (boto3 low-level clients are thread safe).
+#botocore keeps only 10 connections by default, with more workers than that the extra
+#connections are thrown away and every transfer would pay a new TLS handshake
+_S3 = boto3.client(
+    "s3",
+    region_name="us-east-1",
+    config=Config(max_pool_connections=_MAX_WORKERS),
+)
+
 
 s4 = APIRouter(
     responses={
@@ -49,58 +97,58 @@ def download_data(
     #Folder inside the bucket where raw files will be stored 
     s3_prefix_path = "raw/day=20231101/"
 
-    #Create AWS S3 client with region to match the bucket region
-    s3=boto3.client('s3', region_name="us-east-1")
-    #Counter of successfully upload files
-    downloaded = 0
-    #We generate filenames sequentially every 5 seconds because the dataset url format is "HHMMSSZ"
-    seconds = 0
-
-    #Continue until the requested number of files is uploaded
-    while downloaded < file_limit:
-        #Convert seconds -> hours, minutes, seconds
-        hh = seconds // 3600
-        mm = (seconds % 3600) // 60
-        ss = seconds % 60
-
-        #Construct filename like "000000Z.json.gz"
-        filename = f"{hh:02d}{mm:02d}{ss:02d}Z.json.gz"
+    def fetch_and_upload(filename: str) -> bool:
         #Complete download URL
         file_url = base_url + filename
 
-        print("Downloading:", filename)
+        logger.debug("Downloading: %s", filename)
 
         try:
+            #Cheap HEAD probe first, most of the misses are 404s and we don't need their body.
+            #Servers that don't implement HEAD answer 405/501, in that case we just try the GET
+            head = _SESSION.head(file_url, timeout=5, allow_redirects=False)
+            if head.status_code not in (200, 405, 501):
+                logger.debug("Skipping (not found): %s", filename)
+                return False
+
             #Request file from ADS-B Exchange
-            r = requests.get(file_url, timeout=20)
+            r = _SESSION.get(file_url, timeout=20)
 
             #Some timestamps do not exist -> skip them
             if r.status_code != 200:
-                print("Skipping (not found):", filename)
-                seconds += 5
-                continue
-            
-            #Save temporarily on disk before uploading
-            with open(filename, "wb") as f:
-                f.write(r.content)
-
-            print("Uploading to S3:", filename)
-            #Upload file to S3 bucket inside raw/day=20231101/
-            s3.upload_file(
-                Filename=filename,
+                logger.debug("Skipping (not found): %s", filename)
+                return False
+
+            logger.debug("Uploading to S3: %s", filename)
+            #Upload file to S3 bucket inside raw/day=20231101/ straight from memory,
+            #no temporary file is written to disk
+            _S3.upload_fileobj(
+                Fileobj=io.BytesIO(r.content),
                 Bucket=s3_bucket,
-                Key=s3_prefix_path + filename
+                Key=s3_prefix_path + filename,
+                Config=_XFER,
             )
-            #Remove temporary local file
-            Path(filename).unlink()
-            #Increase counter only if upload was succesful 
-            downloaded += 1
+            #Count only if upload was succesful
+            return True
 
         except Exception as e:
             #Network/AWS errors are logged but program continues
-            print("Error:", e)
-        #Move to next 5-second timestamp
-        seconds += 5
+            logger.warning("Error with %s: %s", filename, e)
+            return False
+
+    #Counter of successfully upload files
+    downloaded = 0
+    #Next filename still to be tried
+    position = 0
+
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        #Continue until the requested number of files is uploaded or the day is over.
+        #Each round only tries as many timestamps as files are still missing, so we never
+        #upload more than file_limit and we always keep the first files in ascending order
+        while downloaded < file_limit and position < len(_FILENAMES):
+            batch = _FILENAMES[position:position + file_limit - downloaded]
+            position += len(batch)
+            downloaded += sum(executor.map(fetch_and_upload, batch))
 
     return "OK"
 
@@ -113,8 +161,8 @@ def prepare_data() -> str:
 
     All the `/api/s1/aircraft/` endpoints should work as usual
     """
-    #Create S3 client with the same region as the bucket
-    s3=boto3.client("s3",region_name="us-east-1")
+    #Reuse the module S3 client, same region as the bucket
+    s3=_S3
     #Bucket name obtained from environment variabel BDI_S3_BUCKET
     bucket=settings.s3_bucket
     #Path inside the bucket where raw files were uploaded
@@ -123,21 +171,25 @@ def prepare_data() -> str:
     local_raw_dir=os.path.join(settings.raw_dir,"day=20231101")
     #Create directory if it doesn't exist
     os.makedirs(local_raw_dir,exist_ok=True)
-    #List all objects stored in S3 under the raw folder
-    response=s3.list_objects_v2(Bucket=bucket,Prefix=prefix)
+    #List all objects stored in S3 under the raw folder, page by page
+    #because list_objects_v2 returns at most 1000 keys per call
+    paginator=s3.get_paginator("list_objects_v2")
+    keys=[obj["Key"] for page in paginator.paginate(Bucket=bucket,Prefix=prefix) for obj in page.get("Contents",[])]
 
-    #If buckee is empty return message
-    if "Contents" not in response:
+    #If bucket is empty return message
+    if not keys:
        return "No files in bucket"
-    #Iterate through all objects in S3
-    for obj in response["Contents"]:
-       #Full path in S3
-       key=obj["Key"]
+
+    def download(key: str) -> None:
        #Extract filename
        filename=key.split("/")[-1]
-        #Local destination path 
+       #Local destination path
        local_path=os.path.join(local_raw_dir,filename)
-       print("Downloading from S3:",filename)
+       logger.debug("Downloading from S3: %s",filename)
        #Download each file from S3 to local disk
-       s3.download_file(bucket,key,local_path)
+       s3.download_file(bucket,key,local_path,Config=_XFER)
+
+    #Download the files concurrently, list() makes any S3 error reach the caller
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+       list(executor.map(download,keys))
     return "OK"
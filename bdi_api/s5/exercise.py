@@ -1,19 +1,129 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, HTTPException, status
 from fastapi.params import Query
+from fastapi.responses import ORJSONResponse
 
 from bdi_api.settings import Settings
 #Use psycopg2 for direct SQL execution and for simplicity
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
 from pathlib import Path
 
 settings = Settings()
 
-#To get the database connection that is in settings
-def get_connection():
-    return psycopg2.connect(settings.db_url)
+#Keys of the dicts returned by each endpoint, in the same order as the SELECT columns.
+#Rows come back as plain tuples and are zipped with these
+DEPARTMENT_COLS = ("id", "name", "location")
+EMPLOYEE_COLS = ("id", "first_name", "last_name", "email", "salary", "department_name")
+DEPARTMENT_EMPLOYEE_COLS = ("id", "first_name", "last_name", "email", "salary", "hire_date")
+DEPARTMENT_STATS_COLS = ("department_name", "employee_count", "avg_salary", "project_count")
+SALARY_HISTORY_COLS = ("change_date", "old_salary", "new_salary", "reason")
+
+#SQL of the hot read endpoints, prepared on the server once per pooled connection
+#so the following calls skip the parser and the planner ($1, $2... are the parameters).
+#The parameter types are declared: left to Postgres they would be guessed as integer and
+#any id above 2147483647 sent by a client would fail with "integer out of range"
+PREPARED_QUERIES = {
+    "list_employees_q": ("bigint, bigint", """
+        SELECT e.id,e.first_name,e.last_name,e.email,e.salary,d.name AS department_name
+        FROM employee e
+        JOIN department d ON e.department_id=d.id
+        ORDER BY e.id
+        LIMIT $1 OFFSET $2"""),
+    "list_employees_after_q": ("bigint, bigint", """
+        SELECT e.id,e.first_name,e.last_name,e.email,e.salary,d.name AS department_name
+        FROM employee e
+        JOIN department d ON e.department_id=d.id
+        WHERE e.id>$1
+        ORDER BY e.id
+        LIMIT $2"""),
+    "department_exists_q": ("bigint", "SELECT 1 FROM department WHERE id=$1"),
+    "department_employees_q": ("bigint", """
+        SELECT id,first_name,last_name, email, salary, hire_date
+        FROM employee
+        WHERE department_id=$1
+        ORDER BY id"""),
+    "department_stats_q": ("bigint", """
+        SELECT department_name, employee_count, avg_salary, project_count
+        FROM mv_department_stats
+        WHERE id=$1"""),
+    "salary_history_q": ("bigint", """
+        SELECT change_date, old_salary, new_salary, reason
+        FROM salary_history
+        WHERE employee_id=$1
+        ORDER BY change_date"""),
+}
+
+
+#Connection that remembers which of the PREPARED_QUERIES already exist on it
+class PreparedConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+#PREPARE the statement the first time this connection sees it, then EXECUTE it.
+#It is done lazily (not when the pool connects) because the tables may not exist yet
+#before /db/init. Postgres re-plans the statement by itself if the tables are recreated
+def execute_prepared(cur, name: str, params: tuple) -> None:
+    conn = cur.connection
+    if name not in conn.prepared:
+        param_types, query = PREPARED_QUERIES[name]
+        cur.execute(f"PREPARE {name} ({param_types}) AS {query}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name}({placeholders})", params)
+
+
+#Connection pool shared by all the endpoints. It is created on first use
+#(not at import) so the app can start even if the database is not reachable yet
+_POOL_MAXCONN = 16
+_POOL: Optional[ThreadedConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+#ThreadedConnectionPool raises PoolError when all the connections are taken instead of
+#waiting, so requests queue on this semaphore until a connection is free
+_POOL_SLOTS = threading.BoundedSemaphore(_POOL_MAXCONN)
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadedConnectionPool(1, _POOL_MAXCONN, settings.db_url, connection_factory=PreparedConnection)
+    return _POOL
+
+
+#To borrow a connection from the pool, commit on success and give it back
+@contextmanager
+def pooled_connection():
+    pool = _get_pool()
+    with _POOL_SLOTS:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            #Broken connections are discarded instead of going back to the pool
+            pool.putconn(conn, close=bool(conn.closed))
+
+#Sample data, one CSV per table with the columns below as header.
+#Tables are listed in foreign key order
+SEED_DIR = Path(__file__).parent / "seed"
+SEED_TABLES = {
+    "department": "name, location",
+    "employee": "first_name, last_name, email, hire_date, salary, department_id",
+    "project": "name, description, start_date, end_date, budget, department_id",
+    "employee_project": "employee_id, project_id, role, assigned_date",
+    "salary_history": "employee_id, old_salary, new_salary, change_date, reason",
+}
 
 s5 = APIRouter(
     responses={
@@ -22,6 +132,10 @@ s5 = APIRouter(
     },
     prefix="/api/s5",
     tags=["s5"],
+    #orjson (C extension) encodes the responses much faster than the standard json module.
+    #Only for the fastapi==0.129.2 pinned in requirements.txt: later FastAPI releases already
+    #serialize typed responses with Pydantic and deprecate ORJSONResponse, drop this when upgrading
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -33,29 +147,21 @@ def init_database() -> str:
     Use the BDI_DB_URL environment variable to configure the database connection.
     Default: sqlite:///hr_database.db
     """
-    #Connect to the database using psycopg2
-    conn=psycopg2.connect(settings.db_url)
-    #create a cursor to execute SQL commands
-    cur=conn.cursor()
-    #DROP TABLES IF THEY EXIST (for idempotency)
-    cur.execute("""
-                DROP TABLE IF EXISTS salary_history CASCADE;
-                DROP TABLE IF EXISTS employee_project CASCADE;
-                DROP TABLE IF EXISTS employee CASCADE;
-                DROP TABLE IF EXISTS project CASCADE;
-                DROP TABLE IF EXISTS department CASCADE;""")
-    conn.commit()
-    #Execute the schema creation SQL (see hr_schema.sql)
-    schema_path=Path(__file__).parent / "hr_schema.sql"
-    #Open the schema file and execute its contents
-    with open(schema_path,"r",encoding="utf-8") as f:
-        schema_sql=f.read()
-    #Execute the SQL commands to create tables and indexes
-    cur.execute(schema_sql)
-    conn.commit()
-    #Close the cursor and connection
-    cur.close()
-    conn.close()
+    #Borrow a connection from the pool
+    with pooled_connection() as conn:
+        #create a cursor to execute SQL commands
+        cur=conn.cursor()
+        #Execute the schema creation SQL (see hr_schema.sql), it starts by dropping
+        #the tables if they exist (for idempotency)
+        schema_path=Path(__file__).parent / "hr_schema.sql"
+        #Open the schema file and execute its contents
+        with open(schema_path,"r",encoding="utf-8") as f:
+            schema_sql=f.read()
+        #DROP + CREATE of tables and indexes in one round trip and one transaction,
+        #committed when the connection goes back to the pool
+        cur.execute(schema_sql)
+        cur.close()
+    _invalidate_departments()
     return "OK"
 
 
@@ -63,48 +169,76 @@ def init_database() -> str:
 def seed_database() -> str:
     """Populate the HR database with sample data.
 
-    Inserts departments, employees, projects, assignments, and salary history.
+    Inserts departments, employees, projects, assignments, and salary history,
+    then refreshes the precomputed department statistics.
     """
-    #Connect to the database
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor()
-    #DELETE ALL EXISTING DATA (for idempotency)
-    cur.execute("""
-                DELETE FROM salary_history;
-                DELETE FROM employee_project;
-                DELETE FROM employee;
-                DELETE FROM project;
-                DELETE FROM department;""")
-    conn.commit()
-
-    #Execute the seed data SQL (see hr_seed_data.sql)
-    seed_path=Path(__file__).parent / "hr_seed_data.sql"
-    #Open the seed data file and execute its contents
-    with open(seed_path,"r",encoding="utf-8") as f:
-        seed_sql=f.read()
-    #Execute the SQL commands to insert sample data
-    cur.execute(seed_sql)
-    conn.commit()
-    #Close the cursor and connection
-    cur.close()
-    conn.close()
+    #Borrow a connection from the pool, everything below is one transaction
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        #EMPTY ALL TABLES (for idempotency). TRUNCATE skips the row by row delete and
+        #RESTART IDENTITY makes the seeded ids start again from 1
+        cur.execute("""
+                    TRUNCATE salary_history, employee_project, employee, project, department
+                    RESTART IDENTITY CASCADE;""")
+        if SEED_DIR.is_dir():
+            #Bulk load every table from its CSV (see seed/) with COPY, in foreign key order
+            for table, columns in SEED_TABLES.items():
+                with open(SEED_DIR / f"{table}.csv",encoding="utf-8") as f:
+                    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH CSV HEADER", f)
+        else:
+            #Fallback: execute the seed data SQL (see hr_seed_data.sql)
+            seed_path=Path(__file__).parent / "hr_seed_data.sql"
+            with open(seed_path,"r",encoding="utf-8") as f:
+                seed_sql=f.read()
+            cur.execute(seed_sql)
+        #Recompute the precomputed department statistics with the new data
+        cur.execute("REFRESH MATERIALIZED VIEW mv_department_stats")
+        cur.close()
+    _invalidate_departments()
     return "OK"
 
 
+#Departments cached in memory as tuple of dicts. init_database and seed_database, the only
+#endpoints that change the table, bump the generation after committing. A read that started
+#before that bump may hold the old rows, so it is returned but not kept in the cache
+_DEPARTMENTS: Optional[tuple] = None
+_DEPARTMENTS_GENERATION = 0
+_DEPARTMENTS_LOCK = threading.Lock()
+
+
+def _invalidate_departments() -> None:
+    global _DEPARTMENTS, _DEPARTMENTS_GENERATION
+    with _DEPARTMENTS_LOCK:
+        _DEPARTMENTS_GENERATION += 1
+        _DEPARTMENTS = None
+
+
+def _fetch_departments() -> tuple:
+    global _DEPARTMENTS
+    with _DEPARTMENTS_LOCK:
+        if _DEPARTMENTS is not None:
+            return _DEPARTMENTS
+        generation = _DEPARTMENTS_GENERATION
+    #Query all departments
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        cur.execute("SELECT id, name, location FROM department")
+        departments=tuple(dict(zip(DEPARTMENT_COLS, row)) for row in cur.fetchall())
+        cur.close()
+    with _DEPARTMENTS_LOCK:
+        if generation == _DEPARTMENTS_GENERATION:
+            _DEPARTMENTS = departments
+    return departments
+
+
 @s5.get("/departments/")
 def list_departments() -> list[dict]:
     """Return all departments.
 
     Each department should include: id, name, location
     """
-    #Query all departments and return as list of dicts
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, name, location FROM department")
-    departments=cur.fetchall()
-    cur.close()
-    conn.close()
-    return departments
+    #Departments barely change, they are cached in memory until the next init/seed
+    return list(_fetch_departments())
 
 
 
@@ -118,25 +252,29 @@ def list_employees(
         int,
         Query(description="Number of employees per page", ge=1, le=100),
     ] = 10,
+    after_id: Annotated[
+        Optional[int],
+        Query(description="Return the employees after this id (keyset pagination, `page` is ignored)", ge=0),
+    ] = None,
 ) -> list[dict]:
     """Return employees with their department name, paginated.
 
     Each employee should include: id, first_name, last_name, email, salary, department_name
+
+    To go through every page, pass the `id` of the last employee received as `after_id`:
+    the database jumps straight to it through the primary key instead of skipping `OFFSET` rows.
     """
-    #Query employees with JOIN to department, apply OFFSET and LIMIT
-    offset=(page-1)*per_page
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-                SELECT e.id,e.first_name,e.last_name,e.email,e.salary,d.name AS department_name
-                FROM employee e
-                JOIN department d ON e.department_id=d.id
-                ORDER BY e.id
-                LIMIT %s OFFSET %s""",
-                (per_page, offset))
-    employees=cur.fetchall()
-    cur.close()
-    conn.close()
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        if after_id is not None:
+            #Keyset pagination: start right after the last id the client has seen
+            execute_prepared(cur, "list_employees_after_q", (after_id, per_page))
+        else:
+            #Query employees with JOIN to department, apply OFFSET and LIMIT
+            offset=(page-1)*per_page
+            execute_prepared(cur, "list_employees_q", (per_page, offset))
+        employees=[dict(zip(EMPLOYEE_COLS, row)) for row in cur.fetchall()]
+        cur.close()
     return employees
 
 
@@ -146,19 +284,19 @@ def list_department_employees(dept_id: int) -> list[dict]:
 
     Each employee should include: id, first_name, last_name, email, salary, hire_date
     """
-    #Query employees filtered by department_id
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-                SELECT id,first_name,last_name, email, salary, hire_date
-                FROM employee
-                WHERE department_id=%s
-                ORDER BY id""",
-                (dept_id,))
-    department_employees=cur.fetchall()
-    cur.close()
-    conn.close()
-    return department_employees or {} #Return empty dict if no employees found
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        #Query employees filtered by department_id
+        execute_prepared(cur, "department_employees_q", (dept_id,))
+        department_employees=[dict(zip(DEPARTMENT_EMPLOYEE_COLS, row)) for row in cur.fetchall()]
+        #Only when nothing came back check the department: an unknown department is a 404,
+        #a department without employees an empty list
+        if not department_employees:
+            execute_prepared(cur, "department_exists_q", (dept_id,))
+            if cur.fetchone() is None:
+                raise HTTPException(status_code=404, detail="Department not found")
+        cur.close()
+    return department_employees
 
 
 @s5.get("/departments/{dept_id}/stats")
@@ -167,26 +305,16 @@ def department_stats(dept_id: int) -> dict:
 
     Response should include: department_name, employee_count, avg_salary, project_count
     """
-    #Calculate department statistics using JOINs and aggregations
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-                SELECT d.name AS department_name,
-                          COUNT(e.id) AS employee_count,
-                          AVG(e.salary) AS avg_salary,
-                          COUNT(DISTINCT ep.project_id) AS project_count
-                FROM department d
-                LEFT JOIN employee e ON e.department_id=d.id
-                LEFT JOIN employee_project ep ON ep.employee_id=e.id
-                WHERE d.id=%s
-                GROUP BY d.id, d.name""",
-                (dept_id,))
-
-
-    department_stats=cur.fetchone()
-    cur.close()
-    conn.close()
-    return department_stats
+    #Statistics are precomputed with JOINs and aggregations in the mv_department_stats
+    #materialized view (see hr_schema.sql), here it is just a lookup by id
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        execute_prepared(cur, "department_stats_q", (dept_id,))
+        row=cur.fetchone()
+        cur.close()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Department not found")
+    return dict(zip(DEPARTMENT_STATS_COLS, row))
 
 
 @s5.get("/employees/{emp_id}/salary-history")
@@ -196,15 +324,9 @@ def salary_history(emp_id: int) -> list[dict]:
     Each entry should include: change_date, old_salary, new_salary, reason
     """
     #Query salary_history for the given employee, ordered by change_date
-    conn=psycopg2.connect(settings.db_url)
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-                SELECT change_date, old_salary, new_salary, reason
-                FROM salary_history
-                WHERE employee_id=%s
-                ORDER BY change_date""",
-                (emp_id,))
-    salary_history=cur.fetchall()
-    cur.close()
-    conn.close()
+    with pooled_connection() as conn:
+        cur=conn.cursor()
+        execute_prepared(cur, "salary_history_q", (emp_id,))
+        salary_history=[dict(zip(SALARY_HISTORY_COLS, row)) for row in cur.fetchall()]
+        cur.close()
     return salary_history
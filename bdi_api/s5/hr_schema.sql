@@ -1,3 +1,4 @@
+DROP MATERIALIZED VIEW IF EXISTS mv_department_stats;
 DROP TABLE IF EXISTS salary_history CASCADE;
 DROP TABLE IF EXISTS employee_project CASCADE;
 DROP TABLE IF EXISTS project CASCADE;
@@ -49,9 +50,36 @@ CREATE TABLE salary_history (
     reason VARCHAR(200)
 );
 
-CREATE INDEX idx_employee_department ON employee(department_id);
+-- Composite keys match the WHERE ... ORDER BY of the API queries so the rows
+-- come out of the index already sorted
+CREATE INDEX idx_employee_department ON employee(department_id, id);
 CREATE INDEX idx_employee_email ON employee(email);
 CREATE INDEX idx_project_department ON project(department_id);
-CREATE INDEX idx_salary_history_employee ON salary_history(employee_id);
+CREATE INDEX idx_salary_history_employee ON salary_history(employee_id, change_date);
 CREATE INDEX idx_employee_project_employee ON employee_project(employee_id);
 CREATE INDEX idx_employee_project_project ON employee_project(project_id);
+
+-- Department KPIs precomputed for /departments/{id}/stats.
+-- Refresh with REFRESH MATERIALIZED VIEW after the data changes (done by the seed).
+-- Employees and projects are aggregated separately so the employee figures are not
+-- multiplied by the number of project assignments of each employee
+CREATE MATERIALIZED VIEW mv_department_stats AS
+SELECT d.id,
+       d.name AS department_name,
+       COALESCE(es.employee_count, 0) AS employee_count,
+       es.avg_salary,
+       COALESCE(ps.project_count, 0) AS project_count
+FROM department d
+LEFT JOIN (
+    SELECT department_id, COUNT(*) AS employee_count, AVG(salary) AS avg_salary
+    FROM employee
+    GROUP BY department_id
+) es ON es.department_id = d.id
+LEFT JOIN (
+    SELECT e.department_id, COUNT(DISTINCT ep.project_id) AS project_count
+    FROM employee e
+    JOIN employee_project ep ON ep.employee_id = e.id
+    GROUP BY e.department_id
+) ps ON ps.department_id = d.id;
+
+CREATE UNIQUE INDEX idx_mv_department_stats_id ON mv_department_stats(id);
@@ -1,41 +1,54 @@
-import pytest #For testing framework 
-from fastapi.testclient import TestClient #To create a test client for the FastAPI application
-from bdi_api.app import app #Importing the FastAPI application to be tested
 from unittest.mock import patch, MagicMock #For mocking external dependencies like boto3 and requests
 
-#Fixture to create a test client for the FastAPI application
-@pytest.fixture
-def client():
-    with TestClient(app) as client:
-        yield client 
+from bdi_api.s4 import exercise
 
+#The `client` fixture for the FastAPI application comes from tests/conftest.py
 
-#Patching the boto3 client and requests.get to test without making actual API or AWS calls
-@patch("bdi_api.s4.exercise.boto3.client")
-@patch("bdi_api.s4.exercise.requests.get")
 
+#Patching the S3 client and the shared HTTP session to test without making actual API or AWS calls
+@patch("bdi_api.s4.exercise._S3")
+@patch("bdi_api.s4.exercise._SESSION.head")
+@patch("bdi_api.s4.exercise._SESSION.get")
 
-def test_download_endpoint_exists(mock_requests, mock_boto, client):
+
+def test_download_endpoint_exists(mock_requests, mock_head, mock_s3, client):
     fake_response = MagicMock(status_code=200, content=b"fake data")
-    #Mocking the response from requests.get to return a succesful response with fake data
+    #Mocking the response from the session get to return a succesful response with fake data
     mock_requests.return_value = fake_response
-    #Mocking the boto3 client to return a MagicMock because we are not testing the actual AWS interactions here
-    mock_boto.return_value = MagicMock()
+    #Mocking the HEAD probe so the file is considered present
+    mock_head.return_value = MagicMock(status_code=200)
     #Making a POST request to the download endpoint with a file limit of 1
     response = client.post("/api/s4/aircraft/download?file_limit=1")
     #Calling the API endpoint and asserting that the response status code is 200, indicating success
     assert response.status_code == 200
+    #The file goes to S3 straight from memory, nothing is written to the local disk
+    mock_s3.upload_fileobj.assert_called_once()
+
+
+#HEAD answering 404 must skip the timestamp without downloading it
+@patch("bdi_api.s4.exercise._S3")
+@patch("bdi_api.s4.exercise._SESSION.head")
+@patch("bdi_api.s4.exercise._SESSION.get")
+def test_download_skips_missing_files(mock_requests, mock_head, mock_s3, client):
+    mock_requests.return_value = MagicMock(status_code=200, content=b"fake data")
+    #Only the first timestamp of the day is missing
+    mock_head.side_effect = lambda url, **kwargs: MagicMock(status_code=404 if url.endswith("000000Z.json.gz") else 200)
+    response = client.post("/api/s4/aircraft/download?file_limit=2")
+    assert response.status_code == 200
+    #The missing file is never requested, the next two are
+    requested = sorted(call.args[0].rsplit("/", 1)[-1] for call in mock_requests.call_args_list)
+    assert requested == ["000005Z.json.gz", "000010Z.json.gz"]
 
 
-#Patching the boto3 client to test the prepare endpoint without making actual AWS calls
-#Only using the boto3 patch because prepare downloads from S3 to local storage
-@patch("bdi_api.s4.exercise.boto3.client")
-def test_prepare_endpoint_exists(mock_boto, client):
+#Patching the S3 client to test the prepare endpoint without making actual AWS calls
+#Only using the S3 patch because prepare downloads from S3 to local storage
+@patch("bdi_api.s4.exercise._S3")
+def test_prepare_endpoint_exists(mock_s3, client, tmp_path, monkeypatch):
+    #Keep the local raw directory inside a temporary folder instead of the repo data/
+    monkeypatch.setattr(exercise.settings, "local_dir", str(tmp_path))
     #S3 mock to simulate the presence of a file in the S3 bucket
-    mock_s3 = MagicMock()
-    mock_s3.list_objects_v2.return_value={"Contents": [{"Key": "raw/day=20231101/000000Z.json.gz"}]}
-    #Mocking the boto3 client to return our mock S3 client
-    mock_boto.return_value = mock_s3
+    page={"Contents": [{"Key": "raw/day=20231101/000000Z.json.gz"}]}
+    mock_s3.get_paginator.return_value.paginate.return_value=[page]
     #Execute the endpoint 
     response = client.post("/api/s4/aircraft/prepare")
     assert response.status_code == 200
\ No newline at end of file
@@ -1,5 +1,11 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
 from fastapi.testclient import TestClient
 
+from bdi_api.s5 import exercise
+
 
 class TestS5Student:
     """
@@ -13,6 +19,84 @@ class TestS5Student:
             response = client.post("/api/s5/db/init")
             assert True
 
+    def test_list_employees_after_id(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            first = client.get("/api/s5/employees/?page=1&per_page=3").json()
+            second = client.get("/api/s5/employees/?page=2&per_page=3").json()
+            response = client.get(f"/api/s5/employees/?after_id={first[-1]['id']}&per_page=3")
+            assert not response.is_error
+            assert response.json() == second
+
+    def test_more_concurrent_requests_than_pooled_connections(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            #Take every pooled connection so the requests below find the pool exhausted
+            with ExitStack() as held, ThreadPoolExecutor(max_workers=40) as executor:
+                for _ in range(exercise._POOL_MAXCONN):
+                    held.enter_context(exercise.pooled_connection())
+                futures = [executor.submit(client.get, "/api/s5/employees/1/salary-history") for _ in range(40)]
+                time.sleep(0.2)
+                #They must wait for a free connection instead of failing
+                assert not any(future.done() for future in futures)
+                held.close()
+                responses = [future.result() for future in futures]
+            assert all(not response.is_error for response in responses)
+
+    def test_list_departments_cache_cleared_by_init(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            assert len(client.get("/api/s5/departments/").json()) > 0
+            client.post("/api/s5/db/init")
+            assert client.get("/api/s5/departments/").json() == []
+
+    def test_list_departments_read_overlapping_seed_is_not_cached(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            exercise._invalidate_departments()
+            with ExitStack() as held, ThreadPoolExecutor(max_workers=1) as executor:
+                #Block the read on the pool after it has looked at the cache
+                for _ in range(exercise._POOL_MAXCONN):
+                    held.enter_context(exercise.pooled_connection())
+                future = executor.submit(client.get, "/api/s5/departments/")
+                time.sleep(0.2)
+                #A seed finishing meanwhile makes whatever that read returns outdated
+                exercise._invalidate_departments()
+                held.close()
+                assert not future.result().is_error
+            assert exercise._DEPARTMENTS is None
+
+    def test_department_stats_values(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            r = client.get("/api/s5/departments/1/stats").json()
+            employees = client.get("/api/s5/departments/1/employees").json()
+            assert r["employee_count"] == len(employees)
+            assert float(r["avg_salary"]) == sum(float(e["salary"]) for e in employees) / len(employees)
+            assert r["project_count"] == 2
+
+    def test_ids_above_integer_range(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            big_id = 99999999999
+            assert client.get(f"/api/s5/employees/{big_id}/salary-history").json() == []
+            assert client.get(f"/api/s5/employees/?after_id={big_id}").json() == []
+            assert client.get(f"/api/s5/departments/{big_id}/employees").status_code == 404
+            assert client.get(f"/api/s5/departments/{big_id}/stats").status_code == 404
+
+    def test_unknown_department(self, client: TestClient) -> None:
+        with client as client:
+            client.post("/api/s5/db/init")
+            client.post("/api/s5/db/seed")
+            assert client.get("/api/s5/departments/999/employees").status_code == 404
+            assert client.get("/api/s5/departments/999/stats").status_code == 404
+
 
 class TestItCanBeEvaluated:
     """